@@ -3,27 +3,58 @@ role-patcher
 
 Creates for TARGET_USER a Role and RoleBinding for each namespace and a Role and RoleBinding for kube-system.
 The Role and RoleBinding for each namespace will have the following permissions:
-- All non-privileged resources (i.e. resources that are not roles, rolebindings, clusterroles, clusterrolebindings)
+- All verbs on every resource the cluster serves, except roles, rolebindings, clusterroles, clusterrolebindings.
+  This covers the core group and every API group found through discovery, e.g. apps, batch, networking.k8s.io,
+  policy, coordination.k8s.io, custom resources and aggregated APIs
 - Read permissions for roles, rolebindings, clusterroles, clusterrolebindings
 The Role and RoleBinding for kube-system will have the following permissions:
 - Read permissions for all resources
 """
 
-from kubernetes import client, config, watch
-from kubernetes.client.rest import ApiException
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from functools import lru_cache, partial
+from logging.handlers import MemoryHandler
 
-def info_print(msg):
+import aiohttp
+from kubernetes_asyncio import client, config, watch
+from kubernetes_asyncio.client.rest import ApiException
+
+logger = logging.getLogger("role-patcher")
+
+# The number of log records buffered before they are written out
+LOG_BUFFER_CAPACITY = 64
+
+def setup_logging():
     """
-    Prints the given message to the console.
+    Sets up the logger to write buffered to stdout.
+    Records are written once the buffer is full, a warning or error is logged, or the buffer is flushed.
 
-    Parameters:
-    msg (str): The message to print.
+    Returns:
+    None
+    """
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("(role-patcher): %(message)s"))
+
+    logger.addHandler(MemoryHandler(capacity=LOG_BUFFER_CAPACITY, flushLevel=logging.WARNING, target=stream_handler))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def flush_logs():
+    """
+    Writes out all buffered log records.
 
     Returns:
     None
     """
 
-    print(f"(role-patcher): {msg}")
+    for handler in logger.handlers:
+        handler.flush()
 
 # The user for which to create the Role and RoleBinding
 TARGET_USER = "k8user"
@@ -31,73 +62,126 @@ TARGET_USER = "k8user"
 # For non-privileged resources
 # For reference see: https://kubernetes.io/docs/reference/access-authn-authz/rbac/#resources
 ROLE_RESOURCES = ["roles", "rolebindings", "clusterroles", "clusterrolebindings"]
+_ROLE_RESOURCES_SET = frozenset(ROLE_RESOURCES)
 READ_VERBS = ["get", "list", "watch"]
 
 # The name of the ClusterRole for non-privileged resources
 CUSTOM_ROLE_NAME = TARGET_USER + "-custom-role"
 
+# Selects only the custom ClusterRole when listing or watching ClusterRoles
+CUSTOM_ROLE_SELECTOR = f"metadata.name={CUSTOM_ROLE_NAME}"
+
+# Appended to the namespace name to get the name of its RoleBinding
+ROLE_BINDING_SUFFIX = "-custom-rolebinding"
+
 PROTECTED_NAMESPACES = ["kube-system"]
 
-def role_exists(api_instance, namespace, role_name):
-    """
-    Returns True if the Role exists, False otherwise.
+# Filters the protected namespaces out on the API server, for reference see: https://kubernetes.io/docs/concepts/overview/working-with-objects/field-selectors/
+PROTECTED_NAMESPACES_SELECTOR = ",".join(f"metadata.name!={ns}" for ns in PROTECTED_NAMESPACES)
 
-    Parameters:
-    api_instance (client.RbacAuthorizationV1Api): The API instance to use.
-    namespace (str): The namespace of the Role.
-    role_name (str): The name of the Role.
+# The field manager owning the applied ClusterRole and RoleBindings, for reference see: https://kubernetes.io/docs/reference/using-api/server-side-apply/
+FIELD_MANAGER = "role-patcher"
+APPLY_CONTENT_TYPE = "application/apply-patch+yaml"
 
-    Returns:
-    bool: True if the Role exists, False otherwise.
-    """
+# The number of concurrent connections to the API server, None keeps the client's default of 100.
+# The two watch streams each hold a connection for good, so it has to exceed
+# MAX_CONCURRENT_NAMESPACES + 2, otherwise namespaces wait for a connection (or forever, at 2 or below)
+CONNECTION_POOL_MAXSIZE = int(os.environ["ROLE_PATCHER_POOL_MAX"]) if "ROLE_PATCHER_POOL_MAX" in os.environ else None
 
-    try:
-        api_instance.read_namespaced_role(name=role_name, namespace=namespace)
-        return True
-    except ApiException as e:
-        if e.status == 404:
-            return False
-        else:
-            # Handle other exceptions if needed
-            raise
+# Retries with exponential backoff for transient API server errors
+RETRY_TOTAL = int(os.environ.get("ROLE_PATCHER_RETRIES", "5"))
+if RETRY_TOTAL < 0:
+    raise ValueError(f"ROLE_PATCHER_RETRIES must be 0 or greater, got {RETRY_TOTAL}")
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# The number of namespaces processed concurrently
+MAX_CONCURRENT_NAMESPACES = 16
+
+# Asks /apis for the aggregated discovery document, which lists the resources of all API groups in one response.
+# Servers without aggregated discovery fall back to the plain APIGroupList
+# For reference see: https://kubernetes.io/docs/concepts/overview/kubernetes-api/#aggregated-discovery
+AGGREGATED_DISCOVERY_ACCEPT = ",".join([
+    "application/json;g=apidiscovery.k8s.io;v=v2;as=APIGroupDiscoveryList",
+    "application/json;g=apidiscovery.k8s.io;v=v2beta1;as=APIGroupDiscoveryList",
+    "application/json"
+])
+
+# How long (in seconds) the discovered resource list is reused before it is fetched again,
+# the ClusterRole is re-applied with a freshly discovered list at the same interval.
+# 0 or less disables both, the list is then fetched whenever it is needed
+RESOURCE_TTL = max(int(os.environ.get("ROLE_PATCHER_RESOURCE_TTL", "300")), 0)
+
+# The shortest pause between two periodic ClusterRole re-applies, whatever RESOURCE_TTL is
+MIN_REFRESH_INTERVAL = 10
+
+# Cached non-privileged resource list and the time it was fetched at
+_resource_cache = {"value": None, "ts": 0}
+
+# Lets only one task at a time refresh the resource list
+_resource_lock = asyncio.Lock()
 
-def cluster_role_exists(api_instance, role_name):
+# Lets only one task at a time apply the ClusterRole
+_cluster_role_lock = asyncio.Lock()
+
+# Set while the custom ClusterRole exists, kept up to date by watch_cluster_role()
+_cluster_role_present = asyncio.Event()
+
+# Bounds the number of namespaces processed at the same time
+_namespace_semaphore = asyncio.Semaphore(MAX_CONCURRENT_NAMESPACES)
+
+# Pending namespace tasks, referenced here so they are not garbage collected while running
+_namespace_tasks = set()
+
+# UIDs of the namespaces whose RoleBinding was applied during this process lifetime, so relists skip them.
+# Keyed by UID, so a namespace deleted and recreated under the same name is processed again
+_processed_namespaces = set()
+
+async def call_with_retries(func, *args, **kwargs):
     """
-    Returns True if the ClusterRole exists, False otherwise.
+    Calls the given API function, retrying with exponential backoff on connection errors
+    and on the status codes in RETRY_STATUS_CODES.
 
     Parameters:
-    api_instance (client.RbacAuthorizationV1Api): The API instance to use.
-    role_name (str): The name of the ClusterRole.
+    func (coroutine function): The API function to call.
+    *args, **kwargs: The arguments to call it with.
 
     Returns:
-    bool: True if the ClusterRole exists, False otherwise.
+    The result of the API function.
     """
 
-    try:
-        api_instance.read_cluster_role(name=role_name)
-        return True
-    except ApiException as e:
-        if e.status == 404:
-            return False
-        else:
-            # Handle other exceptions if needed
-            raise
+    # Always make at least one attempt
+    retries = max(RETRY_TOTAL, 0)
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except ApiException as e:
+            if e.status not in RETRY_STATUS_CODES or attempt == retries:
+                raise
+        except aiohttp.ClientError:
+            if attempt == retries:
+                raise
 
-def role_binding_exists(api_instance, namespace, role_binding_name):
+        await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt)
+
+    # Unreachable, the last attempt either returns or raises
+    raise RuntimeError(f"No attempt was made to call {func}")
+
+async def role_exists(api_instance, namespace, role_name):
     """
-    Returns True if the RoleBinding exists, False otherwise.
+    Returns True if the Role exists, False otherwise.
 
     Parameters:
     api_instance (client.RbacAuthorizationV1Api): The API instance to use.
-    namespace (str): The namespace of the RoleBinding.
-    role_binding_name (str): The name of the RoleBinding.
+    namespace (str): The namespace of the Role.
+    role_name (str): The name of the Role.
 
     Returns:
-    bool: True if the RoleBinding exists, False otherwise.
+    bool: True if the Role exists, False otherwise.
     """
 
     try:
-        api_instance.read_namespaced_role_binding(name=role_binding_name, namespace=namespace)
+        await api_instance.read_namespaced_role(name=role_name, namespace=namespace)
         return True
     except ApiException as e:
         if e.status == 404:
@@ -106,7 +190,7 @@ def role_binding_exists(api_instance, namespace, role_binding_name):
             # Handle other exceptions if needed
             raise
 
-def del_role(api_instance, namespace, role_name):
+async def del_role(api_instance, namespace, role_name):
     """
     Deletes the Role with the given name.
 
@@ -119,44 +203,30 @@ def del_role(api_instance, namespace, role_name):
     None
     """
 
-    api_instance.delete_namespaced_role(name=role_name, namespace=namespace)
+    await api_instance.delete_namespaced_role(name=role_name, namespace=namespace)
 
-def del_cluster_role(api_instance, role_name):
+@lru_cache(maxsize=4)
+def _build_cluster_role_body(non_role_resources):
     """
-    Deletes the ClusterRole with the given name.
+    Builds the ClusterRole object for the given permissions.
+    The result is cached, since the resource list rarely changes between calls.
 
     Parameters:
-    api_instance (client.RbacAuthorizationV1Api): The API instance to use.
-    role_name (str): The name of the ClusterRole.
+    non_role_resources (tuple): The non-privileged resources, as a tuple to be hashable and keep their order.
 
     Returns:
-    None
-    """
-
-    api_instance.delete_cluster_role(name=role_name)
-
-def create_custom_cluster_role(api_instance, non_role_resources):
-    """
-    Creates a ClusterRole for the given name and permissions.
-
-    Parameters:
-    api_instance (client.RbacAuthorizationV1Api): The API instance to use.
-    role_name (str): The name of the ClusterRole.
-    non_role_resources (list): The list of non-privileged resources.
-
-    Returns:
-    None
+    client.V1ClusterRole: The ClusterRole object.
     """
 
     # Define the ClusterRole object, for reference see: https://kubernetes.io/docs/reference/access-authn-authz/rbac/#role-and-clusterrole
-    cluster_role = client.V1ClusterRole(
+    return client.V1ClusterRole(
         api_version="rbac.authorization.k8s.io/v1",
         kind="ClusterRole",
         metadata=client.V1ObjectMeta(name=CUSTOM_ROLE_NAME),
         rules=[
             client.V1PolicyRule(
                 api_groups=["*"],
-                resources=non_role_resources,
+                resources=list(non_role_resources),
                 verbs=["*"]
             ),
             client.V1PolicyRule(
@@ -167,12 +237,34 @@ def create_custom_cluster_role(api_instance, non_role_resources):
         ]
     )
 
-    # Create the ClusterRole
-    api_instance.create_cluster_role(body=cluster_role)
+async def create_custom_cluster_role(api_instance, non_role_resources):
+    """
+    Creates or updates the ClusterRole for the given permissions using Server-Side Apply.
+
+    Parameters:
+    api_instance (client.RbacAuthorizationV1Api): The API instance to use.
+    role_name (str): The name of the ClusterRole.
+    non_role_resources (list): The list of non-privileged resources.
 
-def create_custom_role_binding(api_instance, ns, role_binding_name, role_name, rkind="Role"):
+    Returns:
+    None
     """
-    Creates a RoleBinding for the given namespace with the given name and permissions.
+
+    cluster_role = _build_cluster_role_body(tuple(non_role_resources))
+
+    # Apply the ClusterRole, a single idempotent request whether it exists or not
+    await call_with_retries(
+        api_instance.patch_cluster_role,
+        name=CUSTOM_ROLE_NAME,
+        body=cluster_role,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type=APPLY_CONTENT_TYPE
+    )
+
+async def create_custom_role_binding(api_instance, ns, role_binding_name, role_name, rkind="Role"):
+    """
+    Creates or updates a RoleBinding for the given namespace with the given name and permissions using Server-Side Apply.
     
     Parameters:
     api_instance (client.RbacAuthorizationV1Api): The API instance to use.
@@ -194,131 +286,433 @@ def create_custom_role_binding(api_instance, ns, role_binding_name, role_name, r
         subjects=[client.RbacV1Subject(api_group="", kind="User", name=TARGET_USER)]
     )
 
-    # Create the RoleBinding
-    api_instance.create_namespaced_role_binding(namespace=ns, body=role_binding)
+    # Apply the RoleBinding, a single idempotent request whether it exists or not
+    await call_with_retries(
+        api_instance.patch_namespaced_role_binding,
+        name=role_binding_name,
+        namespace=ns,
+        body=role_binding,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type=APPLY_CONTENT_TYPE
+    )
 
 
-def get_resource_list(api_instance_1, api_instance_2, api_instance_3):
+async def get_json(api_client, path, accept="application/json"):
     """
-    Returns a list of all resources in the cluster.
+    Sends a GET request to the given path of the API server and returns the decoded JSON body.
 
     Parameters:
-    api_instance_1 (client.CoreV1Api): The API instance to use.
-    api_instance_2 (client.AppsV1API): The API instance to use.
-    api_instance_3 (client.ApiextensionsV1Api): The API instance to use.
+    api_client (client.ApiClient): The API client to use.
+    path (str): The path to request.
+    accept (str): The Accept header of the request.
 
+    Returns:
+    dict: The decoded response body.
+    """
+
+    response = await api_client.call_api(
+        path, "GET",
+        header_params={"Accept": accept},
+        auth_settings=["BearerToken"],
+        _preload_content=False
+    )
+
+    # Without preloading, the response is neither read nor checked by the client
+    try:
+        data = await response.read()
+    finally:
+        response.release()
+    if not 200 <= response.status <= 299:
+        raise ApiException(status=response.status, reason=response.reason)
+
+    return json.loads(data)
+
+async def iter_group_resources(api_client, discovery):
+    """
+    Yields the resources of all API groups, i.e. everything but the core group.
+    Includes custom resources, since every CRD is served by its own API group.
+
+    Parameters:
+    api_client (client.ApiClient): The API client to use.
+    discovery (dict): The response of /apis, either an APIGroupDiscoveryList or an APIGroupList.
+
+    Returns:
+    async generator: The names of the resources of all API groups.
+    """
+
+    if discovery.get("kind") == "APIGroupDiscoveryList":
+        for group in discovery.get("items", []):
+            for version in group.get("versions", []):
+                for resource in version.get("resources", []):
+                    yield resource["resource"]
+                    for subresource in resource.get("subresources") or []:
+                        yield f"{resource['resource']}/{subresource['subresource']}"
+    else:
+        # Without aggregated discovery each group version has to be requested on its own,
+        # all versions are walked since some resources are not served in the preferred one
+        for group in discovery.get("groups", []):
+            for version in group.get("versions", []):
+                resource_list = await call_with_retries(get_json, api_client, f"/apis/{version['groupVersion']}")
+                for resource in resource_list.get("resources", []):
+                    yield resource["name"]
+
+async def get_resource_list(api_instance):
+    """
+    Yields all resources in the cluster, possibly with duplicates.
+
+    Parameters:
+    api_instance (client.CoreV1Api): The API instance to use.
 
     Returns:
-    list: A list of all resources in the cluster.
+    async generator: The names of all resources in the cluster.
     """
 
+    # The two discovery calls are independent, so run them concurrently
+    core_resources, discovery = await asyncio.gather(
+        call_with_retries(api_instance.get_api_resources),
+        call_with_retries(get_json, api_instance.api_client, "/apis", AGGREGATED_DISCOVERY_ACCEPT)
+    )
+
     # Get list of normal resources
     # For reference see: https://kubernetes.io/docs/reference/access-authn-authz/rbac/#resources
-    resources = api_instance_1.get_api_resources()
-    resources = [resource.name for resource in resources.resources]
-
-    # Get list of app resources
-    # For reference see: 
-    app_resources = api_instance_2.get_api_resources()
-    app_resources = [resource.name for resource in app_resources.resources]
-    resources.extend(app_resources)
-    
-    # Get list of custom resources
-    # For reference see: https://kubernetes.io/docs/concepts/extend-kubernetes/api-extension/custom-resources/
-    custom_resources = api_instance_3.list_custom_resource_definition()
-    custom_resources = [resource.spec.names.plural for resource in custom_resources.items]
-    resources.extend(custom_resources)
+    for resource in core_resources.resources:
+        yield resource.name
 
-    return resources
+    # Get list of all other resources, e.g. apps and custom resources
+    # For reference see: https://kubernetes.io/docs/concepts/extend-kubernetes/api-extension/custom-resources/
+    async for resource in iter_group_resources(api_instance.api_client, discovery):
+        yield resource
 
 
-def get_non_privilege_resource_list(api_instance_1, api_instance_2, app_instance_3):
+async def get_non_privilege_resource_list(api_instance):
     """
     Returns a list of all non-privileged resources in the cluster.
 
     Parameters:
-    api_instance_1 (client.CoreV1Api): The API instance to use.
-    api_instance_2 (client.AppsV1API): The API instance to use.
-    api_instance_3 (client.ApiextensionsV1Api): The API instance to use.
+    api_instance (client.CoreV1Api): The API instance to use.
 
     Returns:
     list: A list of all non-privileged resources in the cluster.
     """
 
-    resources = get_resource_list(api_instance_1, api_instance_2, app_instance_3)
-    return list(set(resources) - set(ROLE_RESOURCES))
+    # Drop duplicates and role resources while consuming the discovered resources,
+    # keeping the discovery order so the generated ClusterRole rule stays the same between runs
+    seen = set()
+    non_role_resources = []
+    async for resource in get_resource_list(api_instance):
+        if resource in _ROLE_RESOURCES_SET or resource in seen:
+            continue
+        seen.add(resource)
+        non_role_resources.append(resource)
 
-def main():
-    info_print("Starting...")
+    return non_role_resources
 
-    try:
-        config.load_incluster_config()
-    except config.ConfigException:
-        config.load_kube_config()
+async def get_non_privilege_resource_list_cached(api_instance, ttl=RESOURCE_TTL):
+    """
+    Returns a list of all non-privileged resources in the cluster, reusing the last result if it is younger than ttl.
 
-    info_print("Configuration loaded...")
+    Parameters:
+    api_instance (client.CoreV1Api): The API instance to use.
+    ttl (int): The number of seconds a fetched list stays valid.
 
-    # For basic core api
-    core_v1 = client.CoreV1Api()
+    Returns:
+    list: A list of all non-privileged resources in the cluster.
+    """
 
-    # For App API
-    apps_v1 = client.AppsV1Api()
+    # Tasks arriving while the list is refreshed wait for that result instead of discovering again
+    async with _resource_lock:
+        now = time.monotonic()
+        if _resource_cache["value"] is None or now - _resource_cache["ts"] >= ttl:
+            _resource_cache["value"] = await get_non_privilege_resource_list(api_instance)
+            _resource_cache["ts"] = now
 
-    # To list all resources
-    api_extensions_api = client.ApiextensionsV1Api()
+        return _resource_cache["value"]
 
-    # To create roles and rolebindings
-    rbac_api = client.RbacAuthorizationV1Api()
+async def refresh_cluster_role(core_v1, rbac_api):
+    """
+    Re-applies the ClusterRole with a freshly discovered resource list every RESOURCE_TTL seconds,
+    so newly installed CRDs are granted without a restart.
+    Runs forever, meant to be started as a background task.
 
-    # Watch for namespace events
-    w = watch.Watch()
+    Parameters:
+    core_v1 (client.CoreV1Api): The API instance to use.
+    rbac_api (client.RbacAuthorizationV1Api): The API instance to use.
+
+    Returns:
+    None
+    """
+
+    while True:
+        await asyncio.sleep(max(RESOURCE_TTL, MIN_REFRESH_INTERVAL))
+        try:
+            async with _cluster_role_lock:
+                await create_custom_cluster_role(rbac_api, await get_non_privilege_resource_list_cached(core_v1, ttl=0))
+                _cluster_role_present.set()
+        except Exception as e:
+            # Keep the task alive on any error, the next interval tries again
+            logger.error(f"Error refreshing ClusterRole for non-ks: {e}...")
+
+
+async def watch_cluster_role(rbac_api):
+    """
+    Watches the custom ClusterRole and keeps _cluster_role_present up to date.
+    Runs forever, meant to be started as a background task.
+
+    Parameters:
+    rbac_api (client.RbacAuthorizationV1Api): The API instance to use.
+
+    Returns:
+    None
+    """
+
+    while True:
+        try:
+            # A fresh Watch, so a restart does not resume from an expired resourceVersion
+            async with watch.Watch() as w:
+                # The watch only reports changes, so sync with the current state on every (re)start
+                # and watch from the resourceVersion of that list, so no deletion in between is missed
+                cluster_roles = await call_with_retries(rbac_api.list_cluster_role, field_selector=CUSTOM_ROLE_SELECTOR)
+                if cluster_roles.items:
+                    _cluster_role_present.set()
+                else:
+                    _cluster_role_present.clear()
+
+                async for event in w.stream(rbac_api.list_cluster_role, field_selector=CUSTOM_ROLE_SELECTOR, resource_version=cluster_roles.metadata.resource_version):
+                    if event['type'] == "DELETED":
+                        logger.warning(f"ClusterRole for non-ks was deleted...")
+                        _cluster_role_present.clear()
+                    elif event['type'] in ("ADDED", "MODIFIED"):
+                        _cluster_role_present.set()
+        except Exception as e:
+            # Keep the task alive on any error, otherwise the flag would go stale
+            logger.error(f"Error watching ClusterRole for non-ks: {e}, restarting watch...")
+            await asyncio.sleep(1)
+
+async def process_namespace(core_v1, rbac_api, namespace_name, namespace_uid):
+    """
+    Creates the RoleBinding for the given namespace, unless that was already done by this process.
+    Recreates the ClusterRole first if it was deleted.
+    Protected namespaces are already filtered out by the API server.
+
+    Parameters:
+    core_v1 (client.CoreV1Api): The API instance to use.
+    rbac_api (client.RbacAuthorizationV1Api): The API instance to use.
+    namespace_name (str): The name of the namespace.
+    namespace_uid (str): The UID of the namespace.
+
+    Returns:
+    None
+    """
+
+    if namespace_uid in _processed_namespaces:
+        return
+
+    async with _namespace_semaphore:
+        logger.info(f"Processing {namespace_name} namespace...")
+        role_binding_name = namespace_name + ROLE_BINDING_SUFFIX
+        if not _cluster_role_present.is_set():
+            async with _cluster_role_lock:
+                # Another task may have recreated it while this one was waiting for the lock
+                if not _cluster_role_present.is_set():
+                    logger.info(f"Creating ClusterRole for non-ks... (since it was deleted)")
+                    try:
+                        await create_custom_cluster_role(rbac_api, await get_non_privilege_resource_list_cached(core_v1))
+                        _cluster_role_present.set()
+                    except ApiException as e:
+                        logger.error(f"Error creating ClusterRole for non-ks: {e} at namespace {namespace_name}...")
+
+        logger.info(f"Applying RoleBinding for namespace...")
+        # Apply RoleBinding for namespace
+        try:
+            await create_custom_role_binding(rbac_api, namespace_name, role_binding_name, CUSTOM_ROLE_NAME, "ClusterRole")
+            _processed_namespaces.add(namespace_uid)
+        except ApiException as e:
+            logger.error(f"Error applying RoleBinding for namespace: {e} at namespace {namespace_name}...")
+
+def namespace_task_done(task):
+    """
+    Cleans up after a finished namespace task and writes out its log records.
+
+    Parameters:
+    task (asyncio.Task): The finished task.
+
+    Returns:
+    None
+    """
+
+    _namespace_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Error processing namespace: {task.exception()!r} at namespace {task.get_name()}...")
+
+    flush_logs()
 
-    info_print("Created API instances...")
+async def sync_namespaces(core_v1, rbac_api):
+    """
+    Lists all namespaces once and processes them concurrently.
+
+    Parameters:
+    core_v1 (client.CoreV1Api): The API instance to use.
+    rbac_api (client.RbacAuthorizationV1Api): The API instance to use.
+
+    Returns:
+    str: The resourceVersion of the list, to start watching from.
+    """
 
-    #recreate the cluster role for non-ks
-    if cluster_role_exists(rbac_api, CUSTOM_ROLE_NAME):
-        #delete and recreate the cluster role for non-ks
-        info_print(f"Deleting ClusterRole for non-ks...")
-        del_cluster_role(rbac_api, CUSTOM_ROLE_NAME)
+    namespaces = await call_with_retries(core_v1.list_namespace, field_selector=PROTECTED_NAMESPACES_SELECTOR)
+    logger.info(f"Processing {len(namespaces.items)} existing namespaces...")
 
-    info_print(f"Creating ClusterRole for non-ks...")
-    create_custom_cluster_role(rbac_api, get_non_privilege_resource_list(core_v1, apps_v1, api_extensions_api))
+    # DELETED events may have been missed before this (re)list, only keep namespaces that still exist
+    _processed_namespaces.intersection_update(namespace.metadata.uid for namespace in namespaces.items)
+
+    # A failing namespace is only logged, as it is for the tasks started by the watch loop
+    results = await asyncio.gather(
+        *(process_namespace(core_v1, rbac_api, namespace.metadata.name, namespace.metadata.uid) for namespace in namespaces.items),
+        return_exceptions=True
+    )
+    for namespace, result in zip(namespaces.items, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing namespace: {result!r} at namespace {namespace.metadata.name}...")
+
+    # The burst of startup records is done, do not keep it waiting for the next events
+    flush_logs()
+
+    return namespaces.metadata.resource_version
+
+async def watch_namespaces(core_v1, rbac_api):
+    """
+    Processes all existing namespaces and then every newly added one.
+    Runs forever.
+
+    Parameters:
+    core_v1 (client.CoreV1Api): The API instance to use.
+    rbac_api (client.RbacAuthorizationV1Api): The API instance to use.
+
+    Returns:
+    None
+    """
+
+    # Bound once and reused for every (re)connect of the watch
+    list_namespaces = partial(core_v1.list_namespace, field_selector=PROTECTED_NAMESPACES_SELECTOR, allow_watch_bookmarks=True)
 
     # Watch for namespace events
-    # For each namespace, create a Role and RoleBinding if they do not exist
-    # For the kube-system namespace, create a Role and RoleBinding if they do not exist
-    for event in w.stream(core_v1.list_namespace, timeout_seconds=0):
-        # Namespace object
-        namespace = event['object']
-        # Namespace name
-        namespace_name = namespace.metadata.name
-        event_type = event['type']
-
-        info_print(f"Namespace: {namespace_name}, Event Type: {event_type}")
-
-        # Event type (ADDED, MODIFIED, DELETED)
-        if event_type == "DELETED" or event_type == "MODIFIED":
-            info_print(f"Skipping...")
-            continue
+    # The return type is given explicitly, since it can not be read from the partial's docstring
+    w = watch.Watch(return_type="V1Namespace")
+
+    # For each new namespace, create a RoleBinding if it does not exist
+    # The watch is resumed from the last seen resourceVersion whenever the connection ends,
+    # and only falls back to listing all namespaces again if that resourceVersion expired
+    resource_version = None
+    # Consecutive failed (re)connects, resets once an event arrives
+    failures = 0
+    while True:
+        # Whether the current stream delivered any event
+        received = False
+        try:
+            if resource_version is None:
+                resource_version = await sync_namespaces(core_v1, rbac_api)
+
+            async for event in w.stream(list_namespaces, resource_version=resource_version, timeout_seconds=0):
+                failures = 0
+                received = True
+                event_type = event['type']
+
+                # Bookmarks only carry the latest resourceVersion
+                if event_type == "BOOKMARK":
+                    resource_version = event['raw_object']['metadata']['resourceVersion']
+                    continue
+
+                # Namespace object
+                namespace = event['object']
+                # Namespace name
+                namespace_name = namespace.metadata.name
+                resource_version = namespace.metadata.resource_version
+
+                logger.info(f"Namespace: {namespace_name}, Event Type: {event_type}")
+
+                # Event type (ADDED, MODIFIED, DELETED)
+                if event_type == "DELETED":
+                    # Its RoleBinding is gone with it
+                    _processed_namespaces.discard(namespace.metadata.uid)
+
+                if event_type == "DELETED" or event_type == "MODIFIED":
+                    logger.info(f"Skipping...")
+                    flush_logs()
+                    continue
+
+                # Process the namespace in the background, so the watch does not stall behind its API calls
+                task = asyncio.create_task(process_namespace(core_v1, rbac_api, namespace_name, namespace.metadata.uid), name=namespace_name)
+                _namespace_tasks.add(task)
+                task.add_done_callback(namespace_task_done)
+        except ApiException as e:
+            if e.status == 410:
+                logger.info(f"Watch expired at resourceVersion {resource_version}, listing namespaces again...")
+                resource_version = None
+                continue
+            if e.status not in RETRY_STATUS_CODES:
+                raise
+            logger.error(f"Error watching namespaces: {e}, reconnecting...")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # The connection dropped, resume from the last seen resourceVersion
+            logger.error(f"Error watching namespaces: {e!r}, reconnecting...")
+        else:
+            logger.info(f"Watch closed, resuming from resourceVersion {resource_version}...")
+            # A stream closed right after it was opened is retried with the same backoff as an error
+            if received:
+                continue
+
+        # Back off exponentially, so an unavailable API server is not hammered with reconnects
+        failures += 1
+        await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** min(failures, 6))
+
+async def main():
+    setup_logging()
+    logger.info("Starting...")
+
+    try:
+        config.load_incluster_config()
+    except config.ConfigException:
+        await config.load_kube_config()
+
+    logger.info("Configuration loaded...")
+
+    # The connection limit is only overridden when configured explicitly
+    configuration = client.Configuration.get_default_copy()
+    if CONNECTION_POOL_MAXSIZE is not None:
+        if CONNECTION_POOL_MAXSIZE <= MAX_CONCURRENT_NAMESPACES + 2:
+            logger.warning(f"ROLE_PATCHER_POOL_MAX={CONNECTION_POOL_MAXSIZE} does not exceed {MAX_CONCURRENT_NAMESPACES + 2}, namespaces will wait for connections...")
+        configuration.connection_pool_maxsize = CONNECTION_POOL_MAXSIZE
+
+    # Shared by all API instances, so only one connection pool is created
+    async with client.ApiClient(configuration=configuration) as api_client:
+        # For basic core api and resource discovery
+        core_v1 = client.CoreV1Api(api_client)
+
+        # To create roles and rolebindings
+        rbac_api = client.RbacAuthorizationV1Api(api_client)
+
+        logger.info("Created API instances...")
+
+        # Apply the cluster role for non-ks, this also updates one left over from a previous run
+        logger.info(f"Applying ClusterRole for non-ks...")
+        await create_custom_cluster_role(rbac_api, await get_non_privilege_resource_list_cached(core_v1))
+        _cluster_role_present.set()
+
+        # Track out-of-band deletions of the ClusterRole instead of polling for it on every namespace
+        cluster_role_task = asyncio.create_task(watch_cluster_role(rbac_api))
+
+        # Grant resources installed later on, e.g. new CRDs, unless refreshing is disabled
+        refresh_task = None
+        if RESOURCE_TTL > 0:
+            refresh_task = asyncio.create_task(refresh_cluster_role(core_v1, rbac_api))
 
-        if not namespace_name in PROTECTED_NAMESPACES:
-            info_print(f"Processing {namespace_name} namespace...")
-            role_binding_name = f"{namespace_name}-custom-rolebinding"
-            if not cluster_role_exists(rbac_api, CUSTOM_ROLE_NAME):
-                info_print(f"Creating ClusterRole for non-ks... (since it was deleted)")
-                try:
-                    create_custom_cluster_role(rbac_api, get_non_privilege_resource_list(core_v1, apps_v1, api_extensions_api))
-                except ApiException as e:
-                    info_print(f"Error creating ClusterRole for non-ks: {e} at namespace {namespace_name}...")
-
-            if not role_binding_exists(rbac_api, namespace_name, role_binding_name):
-                info_print(f"Creating RoleBinding for namespace...")
-                # Create RoleBinding for namespace
-                try:
-                    create_custom_role_binding(rbac_api, namespace_name, role_binding_name, CUSTOM_ROLE_NAME, "ClusterRole")
-                except ApiException as e:
-                    info_print(f"Error creating RoleBinding for namespace: {e} at namespace {namespace_name}...")
+        try:
+            await watch_namespaces(core_v1, rbac_api)
+        finally:
+            cluster_role_task.cancel()
+            if refresh_task is not None:
+                refresh_task.cancel()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())